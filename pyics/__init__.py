@@ -2,17 +2,29 @@
 """
 
 
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
 from ctypes import (
     byref, c_double, c_int, c_size_t, c_uint, c_void_p, create_string_buffer)
+import operator
 import os
+import shutil
+from tempfile import TemporaryDirectory
+import threading
 
 import numpy as np
 
 from .api import *
+from .h2ctypes import DLLError
 
 
-__all__ = ["ICS"]
+__all__ = ["ICS", "ICSPool", "ICSArray", "stats", "project", "to_dask"]
+
+
+# Approximate size, in bytes, of the blocks read by streaming operations.
+_BLOCK_SIZE = 2 ** 24
+# History key describing bit-packed data, as "<dtype> <length> <nbits>".
+_PACKING_KEY = "pyics_packing"
 
 
 _ics_np_types = [
@@ -38,11 +50,145 @@ def _new_string():
     return create_string_buffer(b" " * ICS_LINE_LENGTH)
 
 
+def _is_path(obj):
+    """Whether `obj` is a path, rather than an in-memory ICS payload.
+
+    Bytes are considered as a payload if they start with an ICS header (whose
+    first line contains the two separator characters).
+    """
+    return (isinstance(obj, (str, os.PathLike))
+            or isinstance(obj, bytes) and obj[2:13] != b"ics_version")
+
+
+def _memfile(source=None):
+    """Create an anonymous in-memory file, optionally filled from `source`.
+
+    `source` can be a bytes-like object or a readable file object (whose whole
+    contents are used if it is seekable).  Return the file descriptor.
+    """
+    fd = os.memfd_create("pyics")
+    if source is not None:
+        try:
+            with open(fd, "wb", closefd=False) as f:
+                if isinstance(source, (bytes, bytearray, memoryview)):
+                    f.write(source)
+                elif hasattr(source, "getbuffer"):
+                    f.write(source.getbuffer())
+                else:
+                    if source.seekable():
+                        source.seek(0)
+                    shutil.copyfileobj(source, f)
+        except Exception:
+            os.close(fd)
+            raise
+    return fd
+
+
+def _fd_path(fd):
+    return "/proc/self/fd/{}".format(fd)
+
+
+def _iter_slab_slices(shape, itemsize, block_size=None):
+    """Split the last axis of an array in slices of about `block_size` bytes.
+
+    `block_size` defaults to `_BLOCK_SIZE`.
+    """
+    if block_size is None:
+        block_size = _BLOCK_SIZE
+    slab_nbytes = int(np.prod(shape[:-1])) * itemsize
+    n_per_block = max(1, block_size // max(slab_nbytes, 1))
+    for start in range(0, shape[-1], n_per_block):
+        yield slice(start, min(start + n_per_block, shape[-1]))
+
+
+def _int_range(dtype, nbits=None):
+    """The range of values of an integer dtype with `nbits` significant bits.
+    """
+    nbits = nbits or 8 * dtype.itemsize
+    if dtype.kind == "u":
+        return 0, 2 ** nbits - 1
+    else:
+        return -2 ** (nbits - 1), 2 ** (nbits - 1) - 1
+
+
+def _pack_bits(array, nbits):
+    """Pack the `nbits` low bits of an integer array's elements into uint8s.
+
+    Packing is done along the first axis, so that the result can be sliced
+    along the other axes.
+    """
+    n0 = array.shape[0]
+    itemsize = array.dtype.itemsize
+    rows = array.reshape((n0, -1), order="F").T
+    m = rows.shape[0]
+    bits = np.unpackbits(
+        rows.astype(array.dtype.newbyteorder(">"))
+        .view(np.uint8).reshape((m, n0, itemsize)),
+        axis=-1)[..., 8 * itemsize - nbits:]
+    packed = np.packbits(bits.reshape((m, n0 * nbits)), axis=-1)
+    return packed.T.reshape(packed.shape[1:] + array.shape[1:], order="F")
+
+
+def _unpack_bits(packed, packing):
+    """Inverse of `_pack_bits`.
+    """
+    dtype, n0, nbits = packing
+    width = 8 * dtype.itemsize
+    rows = packed.reshape((packed.shape[0], -1), order="F").T
+    m = rows.shape[0]
+    bits = np.unpackbits(rows, axis=-1, count=n0 * nbits).reshape(
+        (m, n0, nbits))
+    full = np.empty((m, n0, width), np.uint8)
+    full[..., width - nbits:] = bits
+    # Sign-extend signed integers.
+    full[..., :width - nbits] = bits[..., :1] if dtype.kind == "i" else 0
+    values = np.packbits(full, axis=-1).view(dtype.newbyteorder(">"))[..., 0]
+    return values.astype(dtype).T.reshape(
+        (n0,) + packed.shape[1:], order="F")
+
+
+def _unpack_itemsize(packing):
+    """Bytes of temporaries used by `_unpack_bits` per unpacked element.
+    """
+    return packing.nbits + 10 * packing.dtype.itemsize
+
+
+def _to_stored(data, dtype, imel_units, nbits):
+    """Convert an array block by block to the dtype to be written.
+
+    If `imel_units` is given, the inverse transformation of
+    `value * scale + origin` is applied.  Values are rounded when converting to
+    integers, and checked to be finite and within the range allowed by `nbits`.
+    """
+    dtype = np.dtype(dtype if dtype is not None else data.dtype)
+    stored = np.empty(data.shape, dtype, order="F")
+    for slab_slice in _iter_slab_slices(
+            data.shape, max(data.dtype.itemsize, dtype.itemsize)):
+        block = data[..., slab_slice]
+        if imel_units is not None:
+            block = (block - imel_units.origin) / imel_units.scale
+        if dtype.kind in "iu":
+            if block.dtype.kind in "fc":
+                if not np.isfinite(block).all():
+                    raise ValueError(
+                        "Non-finite data cannot be stored as {}".format(dtype))
+                block = np.rint(block)
+            lo, hi = _int_range(dtype, nbits)
+            if block.size and (block.min() < lo or block.max() > hi):
+                raise ValueError(
+                    "Data out of range for {} with {} significant bits".format(
+                        dtype, nbits or 8 * dtype.itemsize))
+        stored[..., slab_slice] = block
+    return stored
+
+
 ImelUnits = namedtuple("ImelUnits", "origin scale units")
 Parameter = namedtuple("Parameter", "order label origin scale units")
 Channel = namedtuple(
     "Channel", "excitation emission pinhole_radius photon_count")
 Sensor = namedtuple("Sensor", "model type na lens_ri medium_ri")
+Stats = namedtuple("Stats", "min max mean histogram")
+_Packing = namedtuple("_Packing", "dtype length nbits")
 
 
 class ICS:
@@ -51,10 +197,14 @@ class ICS:
     ICS objects can be used as context managers.  Note that libics actually
     writes the data to the file only when the file is closed!
 
+    The constructor reads the whole data.  Handles from `ICSPool.open` only
+    parse the metadata; their data can then be read whole with `read`, or in
+    part with `read_region`.  For lazy, on-demand access, see `ICSArray`.
+
     Attributes:
     -----------
     data: ndarray
-        The contents of the file (partial reads are not supported).
+        The contents of the file, as read by the constructor.
         The ndarray's dtype and shape reflect the layout given in the ICS file.
     significant_bits: int
     coordinate_system: string
@@ -74,40 +224,230 @@ class ICS:
 
     def _init(self, path, mode):
         """Common initialization method to both constructors.
+
+        Non-path sources and destinations are backed by anonymous in-memory
+        files (memfds), which libics accesses through their /proc/self/fd
+        entries.  For (header, data) pairs, libics derives the data file name
+        from the header file name, so both are reached through symlinks in a
+        temporary directory on disk; only the symlinks, not the payload, are
+        written there.
         """
         self.mode = mode
         self._ip = c_void_p()
-        dll.IcsOpen(byref(self._ip), os.fsencode(path), mode.encode("ascii"))
+        self._fds = []
+        self._tmpdir = None
+        self._dest = None
+        self._streamed = False
+        try:
+            if not _is_path(path):
+                path, mode = self._init_memfiles(path, mode)
+            dll.IcsOpen(
+                byref(self._ip), os.fsencode(path), mode.encode("ascii"))
+        except Exception:
+            self._dest = None
+            self._close_memfiles()
+            raise
         self.closed = False
 
-    def __init__(self, path, mode="r"):
+    def _init_memfiles(self, obj, mode):
+        """Set up in-memory files for a non-path source or destination.
+
+        Return the path and mode to be passed to IcsOpen.
+        """
+        if mode.startswith("w"):
+            if mode != "w2":
+                raise ValueError(
+                    "Only version 2 files can be written to file objects")
+            self._dest = obj
+            self._fds.append(_memfile())
+            return _fd_path(self._fds[0]), "w2f"
+        if mode != "r":
+            raise ValueError("In-memory ICS files can only be opened for read")
+        if isinstance(obj, tuple):
+            header, data = obj
+            # Register each fd right away, so that _close_memfiles can release
+            # it if a later step fails.
+            self._fds.append(_memfile(header))
+            self._fds.append(_memfile(data))
+            # libics derives the data file name from the header file name.
+            self._tmpdir = TemporaryDirectory()
+            path = os.path.join(self._tmpdir.name, "data.ics")
+            os.symlink(_fd_path(self._fds[0]), path)
+            os.symlink(_fd_path(self._fds[1]),
+                       os.path.join(self._tmpdir.name, "data.ids"))
+            return path, "r"
+        self._fds.append(_memfile(obj))
+        return _fd_path(self._fds[0]), "rf"
+
+    def _close_memfiles(self):
+        if self._dest is not None:
+            with open(self._fds[0], "rb", closefd=False) as f:
+                shutil.copyfileobj(f, self._dest)
+            self._dest = None
+        for fd in self._fds:
+            os.close(fd)
+        self._fds = []
+        if self._tmpdir is not None:
+            self._tmpdir.cleanup()
+            self._tmpdir = None
+
+    def __init__(self, path, mode="r", *, dtype=None, apply_imel_units=False):
         """Open an ICS file for read ("r") or update ("rw").
 
         The "f" suffix avoids forcing the name suffix to ".ics".  To open files
         for writing, use the `ICS.writing` constructor.
+
+        Instead of a path, an in-memory ICS file can be read (mode "r" only)
+        from a readable file object or a bytes-like object holding a version 2
+        file, or from a (header, data) pair of such objects.  This relies on
+        `os.memfd_create`, and thus on Linux 3.17+.
+
+        Use the `dtype` keyword argument to convert the data while it is read,
+        block by block, into a single array of that dtype.  If
+        `apply_imel_units` is set, the data is also transformed into
+        `value * scale + origin` using the file's imel units; `dtype` then
+        defaults to the smallest floating type that can hold the stored values.
+        Files using the "compress" mode cannot be read block by block by
+        libics, so their conversion needs a temporary copy of the native data.
         """
         if mode.startswith("w"):
             raise ValueError("Use ICS.writing for writing")
         self._init(path, mode)
+        self._read_header()
+        self.data = self.read(dtype, apply_imel_units)
+
+    @classmethod
+    def _open(cls, path, mode="r"):
+        """Open an ICS file and parse its header, without reading the data.
+        """
+        self = object.__new__(cls)
+        self._init(path, mode)
+        self._read_header()
+        return self
+
+    def _read_header(self):
+        """Read the layout and the metadata.
+        """
         self._layout = layout = dll.IcsGetLayout(
             self._ip, c_uint(), c_int(), (c_size_t * ICS_MAXDIM)())
-        dtype = _as_np_type[Ics_DataType(layout.dt)]
-        self.data = np.empty(
-            layout.dims[:layout.ndims], dtype=dtype, order="F")
-        dll.IcsGetData(self._ip,
-                       self.data.ctypes._as_parameter_,
-                       self.data.size * dtype.itemsize)
+        self._dtype = _as_np_type[Ics_DataType(layout.dt)]
+        self._shape = tuple(layout.dims[:layout.ndims])
         self.significant_bits = self._get_significant_bits()
         self.coordinate_system = self._get_coordinate_system()
         self.imel_units = self._get_imel_units()
         self.parameters = self._get_parameters()
-        self.history = self._get_history()
+        history = self._get_history()
+        self.history = [(k, v) for k, v in history if k != _PACKING_KEY]
         self.channels = self._get_channels()
         self.sensor = self._get_sensor()
+        self._packing = None
+        for k, v in history:
+            if k == _PACKING_KEY:
+                dtype, length, nbits = v.split()
+                self._packing = _Packing(
+                    np.dtype(dtype), int(length), int(nbits))
+        self._stored_dtype = self._dtype
+        self._stored_shape = self._shape
+        if self._packing is not None:
+            self._dtype = self._packing.dtype
+            self._shape = (self._packing.length,) + self._shape[1:]
+            self.significant_bits = self._packing.nbits
+
+    def read(self, dtype=None, apply_imel_units=False):
+        """Read the data.
+
+        See the constructor for the meaning of `dtype` and `apply_imel_units`.
+        """
+        self._check_not_streamed()
+        if dtype is None and not apply_imel_units:
+            return self._read()
+        else:
+            return self._read_converted(dtype, apply_imel_units)
+
+    def _read(self):
+        """Read the whole data in its native dtype.
+        """
+        stored = np.empty(
+            self._stored_shape, dtype=self._stored_dtype, order="F")
+        dll.IcsGetData(self._ip,
+                       stored.ctypes._as_parameter_,
+                       stored.size * self._stored_dtype.itemsize)
+        if self._packing is None:
+            return stored
+        data = np.empty(self._shape, dtype=self._dtype, order="F")
+        for slab_slice in _iter_slab_slices(
+                self._shape, _unpack_itemsize(self._packing)):
+            data[..., slab_slice] = _unpack_bits(
+                stored[..., slab_slice], self._packing)
+        return data
+
+    def _check_not_streamed(self):
+        if self._streamed:
+            raise ValueError(
+                "The data of this handle has already been streamed, and "
+                "libics cannot rewind it; reopen the file to read it again")
+
+    def read_region(self, offset, size, sampling=None):
+        """Read a rectangular region of the data.
+
+        `offset`, `size` and `sampling` are sequences with one entry per axis;
+        `sampling` defaults to 1 on all axes.  The result has shape
+        `ceil(size / sampling)`.
+
+        libics cannot read regions of files using the "compress" mode; their
+        data is read whole, then sliced.
+        """
+        offset, size = tuple(offset), tuple(size)
+        sampling = (tuple(sampling) if sampling is not None
+                    else (1,) * len(size))
+        try:
+            if self._packing is None:
+                return self._read_stored_region(offset, size, sampling)
+            # Packed rows can only be unpacked whole.
+            stored = self._read_stored_region(
+                (0,) + offset[1:], self._stored_shape[:1] + size[1:],
+                (1,) + sampling[1:])
+        except DLLError as error:
+            if error.code != Ics_Error.IcsErr_BlockNotAllowed:
+                raise
+            return self._read()[tuple(
+                slice(start, start + n, step)
+                for start, n, step in zip(offset, size, sampling))]
+        return _unpack_bits(stored, self._packing)[
+            offset[0]:offset[0] + size[0]:sampling[0]]
+
+    def _read_stored_region(self, offset, size, sampling):
+        shape = tuple(-(-n // step) for n, step in zip(size, sampling))
+        data = np.empty(shape, dtype=self._stored_dtype, order="F")
+        if data.size:
+            array_t = c_size_t * len(shape)
+            dll.IcsGetROIData(self._ip, array_t(*offset), array_t(*size),
+                              array_t(*sampling),
+                              data.ctypes._as_parameter_, data.nbytes)
+        return data
+
+    def _read_converted(self, dtype, apply_imel_units):
+        """Read the data block by block, converting it to `dtype`.
+        """
+        if dtype is None:
+            dtype = np.result_type(self._dtype, np.float32)
+        dtype = np.dtype(dtype)
+        if apply_imel_units and dtype.kind not in "fc":
+            raise ValueError("Applying imel units requires a floating dtype")
+        data = np.empty(self._shape, dtype=dtype, order="F")
+        origin, scale, _ = self.imel_units
+        for start, block in self._iter_blocks():
+            out = data[..., start:start + block.shape[-1]]
+            out[...] = block
+            if apply_imel_units:
+                out *= scale
+                out += origin
+        return data
 
     @classmethod
     def writing(cls, path, data_or_source, data_template=None, *,
-                version=2, compression=0, nbits=None):
+                version=2, compression=0, nbits=None,
+                dtype=None, imel_units=None, pack=False):
         """Write a numpy array or a path to a source file in a new ICS file.
 
         If `data_or_source` is a numpy array, later modifications to the array
@@ -117,6 +457,9 @@ class ICS:
         `data_template` should be a numpy array whose dtype and shape will be
         used.  Non-zero offsets are not allowed.
 
+        `path` can also be a writable file object, to which the file is written
+        when it is closed (only version 2 files are supported).
+
         Use the `version` keyword argument to set the ICS version used.
 
         Use the `compression` keyword argument to set the compression level.
@@ -124,9 +467,30 @@ class ICS:
         supported.
 
         Use the `nbits` keyword argument to set the number of significant bits.
+
+        Use the `dtype` keyword argument to convert a numpy array, block by
+        block, to the dtype stored in the file.  If `imel_units` (an ImelUnits
+        namedtuple) is given, it is recorded in the file and the data is stored
+        as `(value - origin) / scale`.  When storing integers, values are
+        rounded and checked to be finite and within the range allowed by
+        `nbits`.  The file is then written from a converted copy, so later
+        modifications to the array are *not* reflected into the file.
+
+        If `pack` is set, integer data is stored bit-packed, using only `nbits`
+        bits per element.  The packing is recorded in the history, so that
+        it is transparently undone when reading the file with PyIcs.  As with
+        `dtype`, the file is written from a packed copy of the array.
         """
         self = object.__new__(cls)
-        if isinstance(data_or_source, np.ndarray):
+        self._packing = None
+        if dtype is not None or imel_units is not None:
+            if not isinstance(data_or_source, np.ndarray):
+                raise TypeError(
+                    "dtype and imel_units require data_or_source to be a "
+                    "numpy array")
+            self._set_data = array = _to_stored(
+                data_or_source, dtype, imel_units, nbits)
+        elif isinstance(data_or_source, np.ndarray):
             self._set_data = array = np.asfortranarray(data_or_source)
         elif isinstance(data_or_source, (str, bytes)):
             source = data_or_source
@@ -134,6 +498,20 @@ class ICS:
         else:
             raise TypeError(
                 "data_or_source should be a numpy array or a (byte)string")
+        if pack:
+            if not isinstance(data_or_source, np.ndarray):
+                raise TypeError(
+                    "pack requires data_or_source to be a numpy array")
+            if array.dtype.kind not in "iu" or nbits is None:
+                raise ValueError("pack requires integer data and nbits")
+            if not 0 < nbits <= 8 * array.dtype.itemsize:
+                raise ValueError(
+                    "nbits must be between 1 and {} for {}".format(
+                        8 * array.dtype.itemsize, array.dtype))
+            if array.ndim < 2:
+                raise ValueError("pack requires at least 2-dimensional data")
+            packing = _Packing(array.dtype, array.shape[0], nbits)
+            self._set_data = array = self._pack(array, packing)
         layout_args = (_as_ics_type[array.dtype],
                        len(array.shape),
                        array.ctypes.shape_as(c_size_t))
@@ -150,16 +528,29 @@ class ICS:
             Ics_Compression.IcsCompr_gzip if compression
             else Ics_Compression.IcsCompr_uncompressed,
             compression)
-        if nbits is not None:
+        self.history = []
+        if pack:
+            self._packing = packing
+            self.set_history([])
+            self.significant_bits = nbits
+        elif nbits is not None:
             dll.IcsSetSignificantBits(self._ip, nbits)
             self.significant_bits = nbits
+        if imel_units is not None:
+            self.set_imel_units(imel_units)
         return self
 
     def close(self):
         """Close a file, writing down the new data and metadata.
         """
         self.closed = True
-        dll.IcsClose(self._ip)
+        try:
+            dll.IcsClose(self._ip)
+        except Exception:
+            self._dest = None  # Don't copy a partially written file.
+            raise
+        finally:
+            self._close_memfiles()
 
     def __del__(self):
         if not getattr(self, "closed", True):
@@ -172,6 +563,70 @@ class ICS:
         if not getattr(self, "closed", True):
             self.close()
 
+    def _iter_blocks(self, block_size=None):
+        """Sequentially read the data as blocks of whole slabs along the last
+        axis.
+
+        Yield `(start, block)` pairs, where `block` holds the slabs
+        `start:start + block.shape[-1]`.  The buffer backing `block` is reused
+        across iterations.  As libics cannot rewind block reads, the handle
+        cannot be streamed or read again afterwards (a ValueError is raised).
+
+        libics cannot read files using the "compress" mode in blocks; their
+        data is read whole, then split.
+        """
+        self._check_not_streamed()
+        self._streamed = True
+        buf = None
+        data = None
+        # The last axis is shared by the stored and unpacked data, but blocks
+        # of packed data are sized by the memory needed to unpack them.
+        if self._packing is None:
+            slab_slices = _iter_slab_slices(
+                self._stored_shape, self._stored_dtype.itemsize, block_size)
+        else:
+            slab_slices = _iter_slab_slices(
+                self._shape, _unpack_itemsize(self._packing), block_size)
+        for slab_slice in slab_slices:
+            if data is not None:
+                yield slab_slice.start, data[..., slab_slice]
+                continue
+            n = slab_slice.stop - slab_slice.start
+            if buf is None:
+                buf = np.empty(self._stored_shape[:-1] + (n,),
+                               dtype=self._stored_dtype, order="F")
+            block = buf[..., :n]
+            try:
+                dll.IcsGetDataBlock(
+                    self._ip, block.ctypes._as_parameter_, block.nbytes)
+            except DLLError as error:
+                if not (slab_slice.start == 0 and error.code
+                        == Ics_Error.IcsErr_BlockNotAllowed):
+                    raise
+                data = self._read()
+                yield slab_slice.start, data[..., slab_slice]
+                continue
+            if self._packing is not None:
+                block = _unpack_bits(block, self._packing)
+            yield slab_slice.start, block
+
+    @staticmethod
+    def _pack(array, packing):
+        """Bit-pack an array block by block, checking its range.
+        """
+        lo, hi = _int_range(array.dtype, packing.nbits)
+        n_bytes = -(-packing.length * packing.nbits // 8)
+        packed = np.empty((n_bytes,) + array.shape[1:], np.uint8, order="F")
+        for slab_slice in _iter_slab_slices(
+                array.shape, 8 * array.dtype.itemsize):
+            block = array[..., slab_slice]
+            if block.size and (block.min() < lo or block.max() > hi):
+                raise ValueError(
+                    "Data out of range for {} significant bits".format(
+                        packing.nbits))
+            packed[..., slab_slice] = _pack_bits(block, packing.nbits)
+        return packed
+
     def dump(self):
         """Dump an ICS file structure to sys.__stdout__.
         """
@@ -246,6 +701,11 @@ class ICS:
         """Set the history.
         """
         dll.IcsDeleteHistory(self._ip, b"")
+        if self._packing is not None:
+            dll.IcsAddHistoryString(
+                self._ip, _PACKING_KEY.encode("ascii"),
+                "{0.dtype.name} {0.length} {0.nbits}".format(
+                    self._packing).encode("ascii"))
         for k, v in history:
             dll.IcsAddHistoryString(
                 self._ip, k.encode("ascii"), v.encode("ascii"))
@@ -290,3 +750,318 @@ class ICS:
         dll.IcsSetSensorLensRI(self._ip, lens_ri)
         dll.IcsSetSensorMediumRI(self._ip, medium_ri)
         self.sensor = sensor
+
+
+class ICSPool:
+    """A thread-safe pool of open ICS files, for repeated reads.
+
+    Handles are keyed by path and modification time, so that modified files
+    are reopened.  At most `max_open` handles, idle or checked out, are open at
+    any time: when the limit is reached, the least recently used idle handle is
+    closed, or, if all handles are checked out, `open` waits for one to be
+    released.  A thread must therefore not hold more than `max_open` handles
+    at once.
+
+    ICSPool objects can be used as context managers, closing all idle handles
+    on exit.
+    """
+
+    def __init__(self, max_open=128):
+        if max_open < 1:
+            raise ValueError("max_open must be at least 1")
+        self.max_open = max_open
+        self._cond = threading.Condition()
+        self._idle = OrderedDict()  # (path, mtime) -> [ICS, ...]
+        self._n_open = 0
+
+    def _pop_idle(self, key):
+        """Remove an idle handle for `key`; the lock must be held.
+        """
+        handles = self._idle[key]
+        ics = handles.pop()
+        if not handles:
+            del self._idle[key]
+        return ics
+
+    @contextmanager
+    def open(self, path):
+        """Check out a read handle for an ICS file, as a context manager.
+
+        The handle's metadata is already parsed, but its data is not read; use
+        `ICS.read` for that.  The handle is reserved to the caller until the
+        end of the with block and must not be closed; concurrent users of the
+        same file get distinct handles.
+        """
+        path = os.path.abspath(path)
+        key = path, os.stat(path).st_mtime_ns
+        to_close = []
+        with self._cond:
+            # Idle handles for older versions of the file are useless.
+            for other_key in [idle_key for idle_key in self._idle
+                              if idle_key[0] == path and idle_key != key]:
+                while other_key in self._idle:
+                    to_close.append(self._pop_idle(other_key))
+            while True:
+                if key in self._idle:
+                    ics = self._pop_idle(key)
+                    break
+                if self._n_open - len(to_close) < self.max_open:
+                    ics = None
+                    break
+                if self._idle:
+                    to_close.append(self._pop_idle(next(iter(self._idle))))
+                else:
+                    self._cond.wait()
+            self._n_open += (ics is None) - len(to_close)
+        for handle in to_close:
+            handle.close()
+        if ics is None:
+            try:
+                ics = ICS._open(path)
+            except Exception:
+                with self._cond:
+                    self._n_open -= 1
+                    self._cond.notify()
+                raise
+        try:
+            yield ics
+        finally:
+            self._release(key, ics)
+
+    def _release(self, key, ics):
+        try:
+            stale = os.stat(key[0]).st_mtime_ns != key[1]
+        except OSError:
+            stale = True
+        if ics.closed or ics._streamed or stale:
+            if not ics.closed:
+                ics.close()
+            with self._cond:
+                self._n_open -= 1
+                self._cond.notify()
+            return
+        with self._cond:
+            self._idle.setdefault(key, []).append(ics)
+            self._idle.move_to_end(key)
+            self._cond.notify()
+
+    def close(self):
+        """Close all idle handles.
+        """
+        with self._cond:
+            handles = [ics for handles in self._idle.values()
+                       for ics in handles]
+            self._idle.clear()
+            self._n_open -= len(handles)
+            self._cond.notify_all()
+        for ics in handles:
+            ics.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+_default_pool = ICSPool()
+
+
+class ICSArray:
+    """A lazy, array-like view of the data of an ICS file.
+
+    Indexing (with integers and slices with positive steps) reads only the
+    selected region from the file, through a shared ICSPool.  `np.asarray`
+    reads the whole data.  ICSArray objects can be wrapped by chunked array
+    libraries, e.g. with `to_dask`.
+
+    Attributes:
+    -----------
+    path: string
+    shape: tuple of ints
+    dtype: numpy dtype
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        with _default_pool.open(self.path) as ics:
+            self.shape = ics._shape
+            self.dtype = ics._dtype
+
+    def __repr__(self):
+        return "<ICSArray {!r}, shape={}, dtype={}>".format(
+            self.path, self.shape, self.dtype)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = key,
+        ellipses = [i for i, k in enumerate(key) if k is Ellipsis]
+        if ellipses:
+            i = ellipses[0]
+            key = (key[:i] + (slice(None),) * (self.ndim - len(key) + 1)
+                   + key[i + 1:])
+        if len(key) > self.ndim:
+            raise IndexError("too many indices")
+        key += (slice(None),) * (self.ndim - len(key))
+        offset, size, sampling, squeezed = [], [], [], []
+        for axis, (k, n) in enumerate(zip(key, self.shape)):
+            if isinstance(k, slice):
+                start, stop, step = k.indices(n)
+                if step <= 0:
+                    raise IndexError("Only positive steps are supported")
+                offset.append(start)
+                size.append(max(stop - start, 0))
+                sampling.append(step)
+            else:
+                i = operator.index(k)
+                if not -n <= i < n:
+                    raise IndexError("index out of bounds")
+                offset.append(i % n)
+                size.append(1)
+                sampling.append(1)
+                squeezed.append(axis)
+        with _default_pool.open(self.path) as ics:
+            data = ics.read_region(offset, size, sampling)
+        return data.reshape(
+            tuple(n for axis, n in enumerate(data.shape)
+                  if axis not in squeezed),
+            order="F")
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[...]
+        return data if dtype is None else data.astype(dtype)
+
+    def to_dask(self, chunks="auto"):
+        """Wrap the file in a dask array, whose chunks are read on demand.
+        """
+        import dask.array as da
+        return da.from_array(self, chunks=chunks, asarray=False, fancy=False)
+
+
+def to_dask(paths, chunks="auto", axis=-1):
+    """Create a lazy dask array from one or several ICS files.
+
+    Several files (with the same shape and dtype) are stacked along a new axis,
+    by default the last one, consistently with the ICS convention of listing
+    the fastest varying axis first.  Requires dask.
+    """
+    if _is_path(paths):
+        return ICSArray(paths).to_dask(chunks)
+    import dask.array as da
+    return da.stack([ICSArray(path).to_dask(chunks) for path in paths],
+                    axis=axis)
+
+
+def _normalize_axes(axes, ndim):
+    if axes is None:
+        return tuple(range(ndim))
+    if np.ndim(axes) == 0:
+        axes = axes,
+    if any(not -ndim <= axis < ndim for axis in axes):
+        raise ValueError("axis out of bounds")
+    return tuple(sorted(set(axis % ndim for axis in axes)))
+
+
+def _reduce_blocks(ics, axes, reducers, histogram_edges=None):
+    """Reduce the data of an open ICS file over `axes`, in a single pass.
+
+    `reducers` is a list of `(ufunc, dtype)` pairs.  Return the list of
+    reductions (with the reduced axes removed) and the histogram counts (if
+    `histogram_edges` is not None).
+    """
+    shape = ics._shape
+    last = len(shape) - 1
+    out_shape = tuple(1 if axis in axes else n for axis, n in enumerate(shape))
+    accs = [None] * len(reducers)
+    counts = (np.zeros(len(histogram_edges) - 1, dtype=np.intp)
+              if histogram_edges is not None else None)
+    for start, block in ics._iter_blocks():
+        for i, (ufunc, dtype) in enumerate(reducers):
+            reduced = ufunc.reduce(
+                block, axis=axes, dtype=dtype, keepdims=True)
+            if last in axes:
+                if accs[i] is None:
+                    accs[i] = reduced
+                else:
+                    ufunc(accs[i], reduced, out=accs[i])
+            else:
+                if accs[i] is None:
+                    accs[i] = np.empty(out_shape, reduced.dtype, order="F")
+                accs[i][..., start:start + block.shape[-1]] = reduced
+        if counts is not None:
+            counts += np.histogram(block, histogram_edges)[0]
+    kept_shape = tuple(n for axis, n in enumerate(shape) if axis not in axes)
+    return [acc.reshape(kept_shape, order="F")[()] for acc in accs], counts
+
+
+def _histogram_edges(ics, bins):
+    if np.ndim(bins) == 1:
+        return np.asarray(bins)
+    if ics._dtype.kind not in "iu":
+        raise ValueError(
+            "Histograms of non-integer data require explicit bin edges")
+    return np.histogram(
+        [], bins, _int_range(ics._dtype, ics.significant_bits))[1]
+
+
+def stats(path, axes=None, histogram_bins=None):
+    """Compute the min, max and mean of an ICS file in a single streaming pass.
+
+    The data is read block by block, so that memory use is bounded by the size
+    of the block buffer and of the results.  Files using the "compress" mode
+    cannot be read block by block by libics, and are read whole instead.
+
+    `axes` selects the axes reduced over (by default, all of them).  If
+    `histogram_bins` is given, a histogram of the whole data is also computed.
+    It can be a sequence of bin edges, or, for integer data, a number of bins
+    evenly covering the range allowed by `significant_bits`.
+
+    Return a Stats namedtuple (min, max, mean, histogram), where `histogram`
+    is either None or a (counts, bin_edges) pair.
+    """
+    with ICS._open(path) as ics:
+        axes = _normalize_axes(axes, len(ics._shape))
+        sum_dtype = (np.complex128 if ics._dtype.kind == "c" else np.float64)
+        edges = (_histogram_edges(ics, histogram_bins)
+                 if histogram_bins is not None else None)
+        (mins, maxs, sums), counts = _reduce_blocks(
+            ics, axes,
+            [(np.minimum, None), (np.maximum, None), (np.add, sum_dtype)],
+            edges)
+        size = int(np.prod([ics._shape[axis] for axis in axes]))
+    return Stats(min=mins, max=maxs, mean=sums / size,
+                 histogram=(counts, edges) if edges is not None else None)
+
+
+def project(path, axis, op="max"):
+    """Project an ICS file along an axis in a single streaming pass.
+
+    `op` can be "max" (maximum-intensity projection), "min", "sum" or "mean".
+    As for `stats`, files using the "compress" mode are read whole.
+    """
+    try:
+        ufunc = {"max": np.maximum, "min": np.minimum,
+                 "sum": np.add, "mean": np.add}[op]
+    except KeyError:
+        raise ValueError("Unknown projection operation: {!r}".format(op))
+    with ICS._open(path) as ics:
+        axes = _normalize_axes(axis, len(ics._shape))
+        if len(axes) != 1:
+            raise ValueError("project takes a single axis")
+        dtype = (np.float64 if op == "mean" and ics._dtype.kind in "iub"
+                 else None)
+        (projection,), _ = _reduce_blocks(ics, axes, [(ufunc, dtype)])
+        if op == "mean":
+            projection = projection / ics._shape[axes[0]]
+    return projection
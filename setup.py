@@ -1,6 +1,5 @@
 #!/usr/bin/env python
-from distutils.core import setup
-import sys
+from setuptools import setup
 
 setup(
     name="PyIcs",
@@ -8,5 +7,6 @@ setup(
     packages=["pyics"],
     license="LICENSE.txt",
     long_description=open("README.md").read(),
-    requires=[] if sys.version_info >= (3, 4) else ["enum (==0.9.19)"]
+    requires=["numpy"],
+    python_requires=">=3.8",
 )
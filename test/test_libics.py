@@ -5,14 +5,17 @@ functions are not implemented.
 """
 
 
+import io
 import os
 import shutil
 from tempfile import TemporaryDirectory
+import threading
 
 import numpy as np
 import pytest
 
-from pyics import ICS
+import pyics
+from pyics import ICS, ICSPool, ImelUnits
 
 
 @pytest.fixture(scope="module") # tmpdir won't work here
@@ -96,3 +99,207 @@ def test_history(datadir):
     with ICS(datadir("result_v1.ics"), "rw") as ics:
         ics.set_history(history)
         assert ics.history == history
+
+
+# Slabs (along the last axis) of result_slabs.ics are 175 * 2 * 2 bytes.
+@pytest.fixture(params=[None, 1, 4 * 175 * 2 * 2],
+                ids=["whole", "one-slab", "four-slabs"])
+def block_size(request, monkeypatch):
+    """Run streaming reads with the default block size (larger than the test
+    files), with one slab per block, and with four slabs per block (leaving a
+    partial last block).
+    """
+    if request.param is not None:
+        monkeypatch.setattr(pyics, "_BLOCK_SIZE", request.param)
+    return request.param
+
+
+@pytest.fixture
+def slabs(datadir):
+    """A file with more slabs along its last axis than testim.ics."""
+    with ICS(datadir("testim.ics")) as ics:
+        data = np.asfortranarray(ics.data.transpose(0, 2, 1))
+    ICS.writing(datadir("result_slabs.ics"), data).close()
+    return datadir("result_slabs.ics"), data
+
+
+def test_stats(slabs, block_size):
+    path, data = slabs
+    result = pyics.stats(path, histogram_bins=16)
+    assert result.min == data.min()
+    assert result.max == data.max()
+    assert np.isclose(result.mean, data.mean())
+    counts, edges = result.histogram
+    assert_equal(counts, np.histogram(data, edges)[0])
+    for axes in [0, -1, (0, 1), (1, 2)]:
+        result = pyics.stats(path, axes=axes)
+        assert_equal(result.min, data.min(axis=axes))
+        assert_equal(result.max, data.max(axis=axes))
+        assert np.allclose(result.mean, data.mean(axis=axes))
+
+
+@pytest.mark.parametrize("op", ["max", "min", "sum", "mean"])
+@pytest.mark.parametrize("axis", [0, -1])
+def test_project(slabs, block_size, op, axis):
+    path, data = slabs
+    assert np.allclose(pyics.project(path, axis, op),
+                       getattr(data, op)(axis=axis))
+
+
+def test_convert(datadir, slabs, block_size):
+    imel_units = ImelUnits(origin=-10., scale=.5, units="counts")
+    _, data = slabs
+    ICS.writing(datadir("result_convert.ics"),
+                data * imel_units.scale + imel_units.origin,
+                dtype=data.dtype, imel_units=imel_units).close()
+    with ICS(datadir("result_convert.ics")) as ics:
+        assert_equal(ics.data, data)
+    with ICS(datadir("result_convert.ics"),
+             dtype=np.float32, apply_imel_units=True) as ics:
+        assert ics.data.dtype == np.float32
+        assert np.allclose(ics.data,
+                           data * imel_units.scale + imel_units.origin)
+    with pytest.raises(ValueError):
+        ICS.writing(datadir("result_convert_bad.ics"),
+                    data.astype(float) + 2 ** 16, dtype=np.uint16)
+    bad = data.astype(float)
+    bad[0, 0, 0] = np.nan
+    with pytest.raises(ValueError):
+        ICS.writing(datadir("result_convert_bad.ics"), bad, dtype=np.uint16)
+
+
+def test_memory(datadir):
+    with ICS(datadir("testim.ics")) as ics:
+        data = ics.data
+    buf = io.BytesIO()
+    ICS.writing(buf, data, version=2).close()
+    with ICS(buf) as ics:
+        assert_equal(ics.data, data)
+    with ICS(buf.getvalue()) as ics:
+        assert_equal(ics.data, data)
+    with open(datadir("testim.ics"), "rb") as header, \
+            open(datadir("testim.ids"), "rb") as ids:
+        with ICS((header.read(), memoryview(ids.read()))) as ics:
+            assert_equal(ics.data, data)
+
+
+    class FailingReader(io.RawIOBase):
+        def readable(self):
+            return True
+
+        def readinto(self, b):
+            raise OSError("read failed")
+
+    # Memfds created before a failure are released.
+    n_fds = len(os.listdir("/proc/self/fd"))
+    with pytest.raises(OSError):
+        ICS((buf.getvalue(), FailingReader()))
+    assert len(os.listdir("/proc/self/fd")) == n_fds
+
+
+def test_pool(datadir):
+    with ICS(datadir("testim.ics")) as ics:
+        data = ics.data
+    path = datadir("result_pool.ics")
+    ICS.writing(path, data, version=2).close()
+
+    def touch():
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    with ICSPool(max_open=2) as pool:
+        with pool.open(path) as ics1, pool.open(path) as ics2:
+            assert ics1 is not ics2
+            assert_equal(ics1.read(), data)
+            # A third handle has to wait for one of the first two.
+            opened = []
+
+            def open_third():
+                with pool.open(path) as ics:
+                    opened.append(ics)
+
+            thread = threading.Thread(target=open_third)
+            thread.start()
+            thread.join(.1)
+            assert thread.is_alive()
+        thread.join()
+        assert opened[0] in (ics1, ics2)
+        assert pool._n_open == 2
+        with pool.open(path) as ics3:
+            assert ics3 in (ics1, ics2)
+            assert_equal(ics3.read(), data)
+            touch()  # Stale handles are closed when released.
+        assert ics3.closed
+        touch()
+        with pool.open(path) as ics4:
+            assert ics4 not in (ics1, ics2)
+            assert_equal(ics4.read(), data)
+        assert pool._n_open <= 2
+        # Streamed handles cannot be read again, and are not recycled.
+        with pool.open(path) as ics5:
+            assert_equal(ics5.read(dtype=np.float32), data)
+            with pytest.raises(ValueError):
+                ics5.read()
+            with pytest.raises(ValueError):
+                ics5.read(dtype=np.float32)
+        assert ics5.closed
+
+
+@pytest.mark.parametrize("compression", [0, 6])
+@pytest.mark.parametrize("dtype", [np.uint16, np.int16])
+def test_pack(datadir, block_size, compression, dtype):
+    data = np.arange(-2 ** 11, 3 * 17 * 19 - 2 ** 11).reshape(
+        (17, 19, 3)).astype(dtype)
+    if dtype == np.uint16:
+        data += 2 ** 11
+    ICS.writing(datadir("result_pack.ics"), data, nbits=12, pack=True,
+                compression=compression).close()
+    with ICS(datadir("result_pack.ics")) as ics:
+        assert ics.significant_bits == 12
+        assert ics.history == []
+        assert_equal(ics.data, data)
+    with ICS(datadir("result_pack.ics"), dtype=np.float32) as ics:
+        assert_equal(ics.data, data.astype(np.float32))
+    result = pyics.stats(datadir("result_pack.ics"))
+    assert (result.min, result.max) == (data.min(), data.max())
+    assert np.isclose(result.mean, data.mean())
+    with pytest.raises(ValueError):
+        ICS.writing(datadir("result_pack.ics"), data, nbits=4, pack=True)
+    with pytest.raises(ValueError):
+        ICS.writing(datadir("result_pack.ics"), data, nbits=17, pack=True)
+
+
+def test_lazy(datadir):
+    with ICS(datadir("testim.ics")) as ics:
+        data = ics.data
+    # testim_c.ics uses the "compress" mode, which cannot be read by region.
+    for fname in ["testim.ics", "testim_c.ics", "result_pack.ics"]:
+        if fname == "result_pack.ics":
+            data = data.astype(np.uint16)
+            ICS.writing(datadir(fname), data, nbits=10, pack=True).close()
+        lazy = pyics.ICSArray(datadir(fname))
+        assert lazy.shape == data.shape
+        assert lazy.dtype == data.dtype
+        assert_equal(np.asarray(lazy), data)
+        assert_equal(lazy[1:-2:3, 5], data[1:-2:3, 5])
+        assert_equal(lazy[..., :4], data[..., :4])
+        assert_equal(lazy[-1, ::2], data[-1, ::2])
+
+
+def test_dask(datadir):
+    pytest.importorskip("dask.array")
+    with ICS(datadir("testim.ics")) as ics:
+        data = ics.data
+    lazy = pyics.to_dask(datadir("testim.ics"), chunks=(16,) * data.ndim)
+    assert_equal(lazy.max(axis=0).compute(), data.max(axis=0))
+    stacked = pyics.to_dask([datadir("testim.ics")] * 3, chunks=16)
+    assert stacked.shape == data.shape + (3,)
+    assert_equal(stacked[..., 1].compute(), data)
+
+
+def test_stats_compress(datadir, block_size):
+    # "compress" files cannot be read in blocks and are read whole instead.
+    expected = pyics.stats(datadir("testim.ics"))
+    assert pyics.stats(datadir("testim_c.ics")) == expected
+    assert_equal(pyics.project(datadir("testim_c.ics"), 0),
+                 pyics.project(datadir("testim.ics"), 0))